@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Batch recompute and replay of recorded MeteoBridge samples.
+Copyright (c) 2018 Robert Paauwe
+
+Recorded samples (see records.CsvRecorder) are loaded as one NumPy
+array per column so unit conversions, derived values and aggregates
+can be computed for a whole day or more in a few vector operations.
+The results can be written back out or replayed through the node
+server's publish path at a controlled speed.
+
+Needs numpy, which the node server itself does not.
+
+  python3 backfill.py history.csv --units us --out us.csv
+  python3 backfill.py history.csv --aggregate day
+  python3 backfill.py --bench
+"""
+import time
+import numpy as np
+import records
+
+
+def load(path):
+    # Returns (timestamps, {(node, key): column}), absent values are NaN.
+    with open(path) as f:
+        header = f.readline().strip().split(',')
+    data = np.genfromtxt(path, delimiter=',', skip_header=1, ndmin=2)
+    columns = {}
+    for i, name in enumerate(header[1:], 1):
+        node, key = name.split('.', 1)
+        columns[(node, key)] = data[:, i]
+    return data[:, 0], columns
+
+
+def save(path, timestamps, columns):
+    keys = sorted(columns)
+    table = np.column_stack([timestamps] + [columns[k] for k in keys])
+    header = ','.join(['time'] + ['%s.%s' % k for k in keys])
+    # %g would round the timestamps to about 1000 seconds.
+    np.savetxt(path, table, delimiter=',', header=header, comments='',
+            fmt=['%.3f'] + ['%.6g'] * len(keys))
+
+
+# Vectorized versions of the TemperatureNode and PressureNode formulas.
+# Inputs are metric arrays.
+def dewpoint(t, h):
+    b = (17.625 * t) / (243.04 + t)
+    c = np.log(h / 100.0)
+    return np.round((243.04 * (c + b)) / (17.625 - c - b), 1)
+
+
+def apparent(t, ws, h):
+    wv = h / 100.0 * 6.105 * np.exp(17.27 * t / (237.7 + t))
+    return np.round(t + (0.33 * wv) - (0.70 * ws) - 4.0, 1)
+
+
+def windchill(t, ws):
+    tf = (t * 1.8) + 32
+    mph = ws / 0.44704
+    p = np.power(mph, 0.16)
+    wc = 35.74 + (0.6215 * tf) - (35.75 * p) + (0.4275 * tf * p)
+    return np.where((tf <= 50.0) & (mph >= 5.0),
+            np.round((wc - 32) / 1.8, 1), t)
+
+
+def heatindex(t, h):
+    tf = (t * 1.8) + 32
+    hi = (-42.379 + (2.04901523 * tf) + (10.1433127 * h) +
+            (-0.22475541 * tf * h) + (-6.83783e-3 * tf * tf) +
+            (-5.481717e-2 * h * h) + (1.22874e-3 * tf * tf * h) +
+            (8.5282e-4 * tf * h * h) + (-1.99e-6 * tf * tf * h * h))
+    return np.where((tf < 80.0) | (h < 40.0), t,
+            np.round((hi - 32) / 1.8, 1))
+
+
+def to_sea_level(station, elevation):
+    i = 287.05
+    a = 9.80665
+    r = 0.0065
+    s = 1013.35
+    n = 288.15
+    l = a / (i * r)
+    c = i * r / a
+    u = np.power(1 + np.power(s / station, c) * (r * elevation / n), l)
+    return np.round(station * u, 3)
+
+
+def _fill(columns, key, values):
+    # Like the derive stage, recorded values win over calculated ones.
+    if key in columns:
+        values = np.where(np.isnan(columns[key]), values, columns[key])
+    columns[key] = values
+
+
+def derive(columns, elevation=None):
+    # Add the derived columns. Rows where an input is missing stay NaN.
+    t = columns.get(('temperature', 'main'))
+    h = columns.get(('humidity', 'main'))
+    ws = columns.get(('wind', 'windspeed'))
+    out = dict(columns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if t is not None and h is not None:
+            _fill(out, ('temperature', 'dewpoint'), dewpoint(t, h))
+            _fill(out, ('temperature', 'heatindex'), heatindex(t, h))
+        if t is not None and ws is not None:
+            _fill(out, ('temperature', 'windchill'), windchill(t, ws))
+        if t is not None and h is not None and ws is not None:
+            _fill(out, ('temperature', 'apparent'), apparent(t, ws, h))
+        station = columns.get(('pressure', 'station'))
+        if station is not None and elevation is not None:
+            # An explicit elevation means the old values are replaced.
+            out[('pressure', 'sealevel')] = to_sea_level(station, elevation)
+    return out
+
+
+def convert(columns, units):
+    # Same conversions the nodes apply in setDriver.
+    out = {}
+    for (node, key), c in columns.items():
+        if node == 'temperature' and units == 'us':
+            c = np.round((c * 1.8) + 32, 1)
+        elif node == 'pressure' and units == 'us':
+            c = np.round(c * 0.02952998751, 3)
+        elif node == 'wind' and key != 'winddir' and units != 'metric':
+            c = np.round(c * 2.23694, 2)
+        elif node == 'rain' and units == 'us':
+            c = np.round(c * 0.03937, 2)
+        elif key in ('solar_energy', 'solar_energy_total'):
+            c = np.round(c, 3)
+        elif key in ('evapotranspiration', 'evapotranspiration_total'):
+            if units == 'us':
+                c = np.round(c * 0.03937, 3)
+            else:
+                c = np.round(c, 2)
+        out[(node, key)] = c
+    return out
+
+
+def aggregate(timestamps, column, period=86400):
+    # min/max/mean of column per local time period (seconds). Returns
+    # (period start, min, max, mean) arrays.
+    offset = time.localtime(timestamps[0]).tm_gmtoff if len(timestamps) else 0
+    valid = ~np.isnan(column)
+    ts = timestamps[valid]
+    values = column[valid]
+    buckets = np.floor((ts + offset) / period).astype(np.int64)
+    starts, first, counts = np.unique(buckets, return_index=True,
+            return_counts=True)
+    return (starts * period - offset,
+            np.minimum.reduceat(values, first),
+            np.maximum.reduceat(values, first),
+            np.add.reduceat(values, first) / counts)
+
+
+def replay(timestamps, columns, publish, speed=100.0, sleep=time.sleep,
+        stop=None):
+    # Feed the rows to publish(sample) as records.Sample objects, with
+    # the recorded gaps shortened by speed. Returns rows per second.
+    # Setting the optional stop event ends the replay early.
+    if stop is not None:
+        sleep = stop.wait
+    keys = [k for k in columns if k in records.INDEX]
+    table = np.column_stack([columns[k] for k in keys]) if keys else \
+            np.zeros((len(timestamps), 0))
+    sample = records.Sample()
+    start = time.perf_counter()
+    count = 0
+    for row in range(len(timestamps)):
+        if row > 0 and speed > 0:
+            gap = (timestamps[row] - timestamps[row - 1]) / speed
+            if gap > 0:
+                sleep(gap)
+        if stop is not None and stop.is_set():
+            break
+        sample.clear(timestamps[row])
+        for key, value in zip(keys, table[row].tolist()):
+            if value == value:   # skip NaN
+                sample[key] = value
+        publish(sample)
+        count += 1
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed > 0 else 0.0
+
+
+def synthetic(rows, interval=60.0):
+    # A made up recording used for benchmarks.
+    ts = time.time() - rows * interval + np.arange(rows) * interval
+    day = (ts % 86400) / 86400.0
+    columns = {
+            ('temperature', 'main'): 15 + 10 * np.sin(2 * np.pi * day),
+            ('humidity', 'main'): 60 + 30 * np.cos(2 * np.pi * day),
+            ('wind', 'windspeed'): np.abs(5 * np.sin(7 * np.pi * day)),
+            ('pressure', 'station'): 1000 + 5 * np.sin(np.pi * day),
+            }
+    return ts, columns
+
+
+if __name__ == "__main__":
+    import argparse
+    import timeit
+
+    ap = argparse.ArgumentParser(description='Recompute recorded samples.')
+    ap.add_argument('history', nargs='?', help='recorded samples (CSV)')
+    ap.add_argument('--units', default='metric', help='metric, us or uk')
+    ap.add_argument('--elevation', type=float, default=None,
+            help='station elevation in meters, recomputes sea level pressure')
+    ap.add_argument('--out', help='write the recomputed samples here')
+    ap.add_argument('--aggregate', choices=['hour', 'day'],
+            help='print min/max/mean per hour or day')
+    ap.add_argument('--bench', action='store_true',
+            help='measure derive, convert and replay throughput')
+    args = ap.parse_args()
+
+    if args.bench:
+        ts, columns = synthetic(100000)
+        n = 10
+        t = timeit.timeit(lambda: convert(derive(columns, 100.0), 'us'),
+                number=n)
+        print('derive+convert %12.0f rows/s' % (len(ts) * n / t))
+        t = timeit.timeit(lambda: aggregate(ts, columns[('temperature', 'main')], 3600),
+                number=n)
+        print('hourly aggregate %10.0f rows/s' % (len(ts) * n / t))
+        rate = replay(ts, derive(columns), lambda s: None, speed=0)
+        print('replay (no sleep) %9.0f rows/s' % rate)
+    elif args.history:
+        ts, columns = load(args.history)
+        columns = convert(derive(columns, args.elevation), args.units)
+        if args.out:
+            save(args.out, ts, columns)
+        if args.aggregate:
+            period = 3600 if args.aggregate == 'hour' else 86400
+            for key in sorted(columns):
+                for s, lo, hi, mean in zip(*aggregate(ts, columns[key], period)):
+                    print('%s %s.%s min %.2f max %.2f mean %.2f' % (
+                        time.strftime('%Y-%m-%d %H:%M', time.localtime(s)),
+                        key[0], key[1], lo, hi, mean))
+    else:
+        ap.print_help()
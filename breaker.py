@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker for MeteoBridge device I/O.
+Copyright (c) 2018 Robert Paauwe
+
+After a few consecutive failures the breaker opens and further attempts
+are skipped until a backoff delay has passed. The delay doubles with
+each failed probe (with some random jitter) up to a maximum. Once the
+delay has passed a single probe is allowed through (half-open); if it
+succeeds the breaker closes again.
+"""
+import random
+import time
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+STATE_NAMES = {
+        CLOSED: 'closed',
+        OPEN: 'open',
+        HALF_OPEN: 'half-open',
+        }
+
+
+class CircuitBreaker(object):
+    def __init__(self, threshold=3, base_delay=60, max_delay=1800,
+            jitter=0.2, clock=time.time):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.clock = clock
+
+        self.state = CLOSED
+        self.failures = 0        # consecutive failures
+        self.total_failures = 0
+        self.opened = 0          # number of times the breaker opened
+        self.delay = 0
+        self.retry_at = 0
+        self.last_success = 0
+
+    def allow(self):
+        # Should we attempt to talk to the device now?
+        if self.state == CLOSED or self.state == HALF_OPEN:
+            return True
+
+        if self.clock() >= self.retry_at:
+            self.state = HALF_OPEN
+            return True
+
+        return False
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.delay = 0
+        self.last_success = self.clock()
+
+    def failure(self):
+        self.failures += 1
+        self.total_failures += 1
+
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state == CLOSED:
+                self.opened += 1
+                self.delay = self.base_delay
+            else:
+                self.delay = min(self.delay * 2, self.max_delay)
+
+            spread = self.delay * self.jitter
+            self.retry_at = self.clock() + self.delay + \
+                    random.uniform(-spread, spread)
+            self.state = OPEN
+
+    def name(self):
+        return STATE_NAMES[self.state]
+
+    def stats(self):
+        return {
+                'state': self.state,
+                'failures': self.failures,
+                'total_failures': self.total_failures,
+                'opened': self.opened,
+                'delay': self.delay,
+                }
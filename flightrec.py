@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Flight recorder for MeteoBridge polls.
+Copyright (c) 2018 Robert Paauwe
+
+Keeps the raw document and stage timings of the last few polls in
+memory. Nothing is written unless something goes wrong, then the whole
+buffer is dumped to a JSON file so the failing document and the ones
+before it can be looked at later. Errors only mark the current entry,
+the dump is written by flush() once the poll's timings are in.
+"""
+import collections
+import json
+import os
+import time
+import traceback
+
+
+class FlightRecorder(object):
+    def __init__(self, logger, size=20, directory='.', min_interval=300):
+        self.logger = logger
+        self.entries = collections.deque(maxlen=size)
+        self.directory = directory
+        self.min_interval = min_interval   # seconds between dumps
+        self.last_dump = 0
+        self.dumps = 0
+        self.pending = None   # reason for the next flush()
+
+    def record(self, document):
+        # Start an entry for a new poll.
+        self.entries.append({
+            'time': time.time(),
+            'document': document,
+            'timings': None,
+            'errors': [],
+            })
+
+    def timings(self, timings):
+        # Only for the poll that started the newest entry, a poll that
+        # never got a document must not overwrite an older entry.
+        if self.entries and self.entries[-1]['timings'] is None:
+            self.entries[-1]['timings'] = timings
+
+    def error(self, stage, err):
+        if self.entries:
+            self.entries[-1]['errors'].append({
+                'stage': stage,
+                'error': repr(err),
+                'traceback': traceback.format_exc(),
+                })
+        if self.pending is None:
+            self.pending = stage
+
+    def flush(self):
+        # Dump if an error was marked since the last flush.
+        if self.pending is None:
+            return None
+        reason = self.pending
+        self.pending = None
+        return self.dump(reason)
+
+    def dump(self, reason):
+        # Rate limited so a device that keeps sending garbage doesn't
+        # fill the disk.
+        now = time.time()
+        if now - self.last_dump < self.min_interval:
+            return None
+        self.last_dump = now
+
+        path = os.path.join(self.directory, time.strftime(
+            'flightrecorder-%Y%m%d-%H%M%S.json', time.localtime(now)))
+        entries = []
+        for entry in list(self.entries):
+            entry = dict(entry)
+            if isinstance(entry['document'], bytes):
+                entry['document'] = entry['document'].decode('utf-8',
+                        'replace')
+            entries.append(entry)
+        try:
+            with open(path, 'w') as f:
+                json.dump({'reason': reason, 'entries': entries}, f,
+                        indent=1)
+        except (OSError, TypeError, ValueError) as err:
+            self.logger.error('Unable to write flight recorder to %s: %s',
+                    path, err)
+            return None
+        self.dumps += 1
+        self.logger.error('Flight recorder written to %s', path)
+        return path
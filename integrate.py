@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Running daily and total integrals of rate values.
+Copyright (c) 2018 Robert Paauwe
+
+Used to turn solar radiation (W/m^2) into solar energy and the
+evapotranspiration rate into an amount. Samples arrive at irregular
+intervals, so the area between two samples is a trapezoid. When two
+samples fall on different days the trapezoid is split at midnight,
+using the interpolated value at midnight, so each day gets its own
+share. Each sample is O(1) and the state is small enough to checkpoint
+to disk every few minutes.
+"""
+import json
+import os
+import time
+
+
+def _day(t):
+    lt = time.localtime(t)
+    return (lt.tm_year, lt.tm_yday)
+
+
+def _midnight(t):
+    # Start of the local day containing t.
+    lt = time.localtime(t)
+    return time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+def _number(v):
+    # A real number from JSON, not a bool or NaN.
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and \
+            v == v
+
+
+class Integrator(object):
+    __slots__ = ('scale', 'max_gap', 'daily', 'total', 'day',
+            'last_time', 'last_value')
+
+    def __init__(self, scale=1.0, max_gap=3600):
+        # scale converts value * seconds into the reported unit. Gaps
+        # longer than max_gap seconds aren't integrated, the device was
+        # probably offline.
+        self.scale = scale
+        self.max_gap = max_gap
+        self.daily = 0.0
+        self.total = 0.0
+        self.day = None
+        self.last_time = None
+        self.last_value = None
+
+    def add(self, t, value):
+        last = self.last_time
+        if last is not None and t <= last:
+            # Repeated or out of order sample, there is nothing to add
+            # and it can't start a new day either.
+            return self.daily, self.total
+
+        day = _day(t)
+        if last is not None and t <= last + self.max_gap:
+            v0 = self.last_value
+            if day != self.day:
+                # Split the trapezoid at midnight.
+                m = _midnight(t)
+                vm = v0 + (value - v0) * (m - last) / (t - last)
+                before = (v0 + vm) / 2.0 * (m - last) * self.scale
+                after = (vm + value) / 2.0 * (t - m) * self.scale
+                self.total += before + after
+                self.daily = after
+            else:
+                area = (v0 + value) / 2.0 * (t - last) * self.scale
+                self.daily += area
+                self.total += area
+        elif day != self.day:
+            self.daily = 0.0
+
+        self.day = day
+        self.last_time = t
+        self.last_value = value
+        return self.daily, self.total
+
+    def state(self):
+        return [self.daily, self.total, self.day, self.last_time,
+                self.last_value]
+
+    def restore(self, state):
+        # Raises ValueError, leaving the integrator untouched, when the
+        # checkpoint doesn't hold the expected numbers.
+        daily, total, day, last_time, last_value = state
+        if not (_number(daily) and _number(total)):
+            raise ValueError('bad totals')
+        if (last_time is None) != (last_value is None) or \
+                (last_time is not None and
+                    not (_number(last_time) and _number(last_value))):
+            raise ValueError('bad last sample')
+        if day is not None:
+            if not isinstance(day, (list, tuple)) or len(day) != 2 or \
+                    not all(isinstance(d, int) and not isinstance(d, bool)
+                        for d in day):
+                raise ValueError('bad day')
+            day = tuple(day)
+        self.daily = daily
+        self.total = total
+        self.day = day
+        self.last_time = last_time
+        self.last_value = last_value
+
+
+# (sample key of the rate, daily key, total key, scale)
+INTEGRALS = [
+        # W/m^2 * s -> kWh/m^2
+        (('light', 'solar_radiation'), ('light', 'solar_energy'),
+            ('light', 'solar_energy_total'), 1.0 / 3600000.0),
+        # mm/h * s -> mm
+        (('light', 'evo'), ('light', 'evapotranspiration'),
+            ('light', 'evapotranspiration_total'), 1.0 / 3600.0),
+        ]
+
+
+class Integrators(object):
+    def __init__(self, logger, path='integrators.json', interval=300):
+        self.logger = logger
+        self.path = path
+        self.interval = interval   # seconds between checkpoints
+        self.saved = 0
+        self.integrators = {}
+        for rate, daily, total, scale in INTEGRALS:
+            self.integrators[rate] = Integrator(scale)
+        self.load()
+
+    def update(self, sample):
+        for rate, daily, total, scale in INTEGRALS:
+            if rate in sample:
+                d, t = self.integrators[rate].add(sample.timestamp,
+                        sample[rate])
+                sample[daily] = d
+                sample[total] = t
+        if sample.timestamp - self.saved >= self.interval:
+            self.save()
+            self.saved = sample.timestamp
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, IOError, ValueError):
+            return
+        for rate, daily, total, scale in INTEGRALS:
+            name = '%s.%s' % rate
+            if name in state:
+                try:
+                    self.integrators[rate].restore(state[name])
+                except (TypeError, ValueError) as err:
+                    self.logger.error('Discarding bad checkpoint for %s in '
+                            '%s: %s', name, self.path, err)
+
+    def save(self):
+        # Write to a temporary file first so a crash can't leave a
+        # truncated checkpoint behind.
+        state = {'%s.%s' % k: i.state() for k, i in self.integrators.items()}
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except (OSError, IOError) as err:
+            self.logger.error('Unable to write %s: %s', self.path, err)
+
+
+def integrate(stream, integrators):
+    for sample in stream:
+        integrators.update(sample)
+        yield sample
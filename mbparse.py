@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Parsers for the MeteoBridge XML live data.
+Copyright (c) 2018 Robert Paauwe
+
+The MeteoBridge sends a small, flat document with one element per
+sensor record, for example:
+
+  <logger>
+    <TH id="th0" temp="5.2" hum="80" dew="2.0" .../>
+    <WIND id="wind0" dir="180" gust="3.2" wind="1.5" chill="5.2" .../>
+  </logger>
+
+Each parser takes the raw document (bytes or str) and yields a
+(tag, id, attrs) tuple for every sensor record. The ElementTree parser
+is the reference implementation, the expat parser avoids building a
+tree and must produce exactly the same output. tests/test_mbparse.py
+checks that on the recorded documents in tests/documents.
+"""
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+
+DEFAULT_PARSER = 'expat'
+
+
+def parse_etree(data):
+    tree = ET.XML(data)
+    return [(child.tag, child.get('id'), dict(child.attrib))
+            for child in tree]
+
+
+def parse_expat(data):
+    records = []
+    depth = [0]
+
+    def start(tag, attrs):
+        depth[0] += 1
+        if depth[0] == 2:
+            records.append((tag, attrs.get('id'), attrs))
+
+    def end(tag):
+        depth[0] -= 1
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.Parse(data, True)
+    return records
+
+
+PARSERS = {
+        'etree': parse_etree,
+        'expat': parse_expat,
+        }
+
+
+def get_parser(name, logger=None):
+    try:
+        return PARSERS[name.lower()]
+    except (KeyError, AttributeError):
+        if logger is not None:
+            logger.warning('Unknown parser %r, using %s instead.', name,
+                    DEFAULT_PARSER)
+        return PARSERS[DEFAULT_PARSER]
+
+
+SAMPLE_DOCUMENTS = [
+        b'<logger>'
+        b'<THB id="thb0" temp="21.3" hum="45" dew="9.0" press="1012.3" '
+        b'seapress="1015.0" fc="0" lowbat="0" date="20191231120000"/>'
+        b'<TH id="th0" temp="5.2" hum="80" dew="2.0" lowbat="0" '
+        b'date="20191231120000"/>'
+        b'<WIND id="wind0" dir="180" gust="3.2" wind="1.5" chill="5.2" '
+        b'lowbat="0" date="20191231120000"/>'
+        b'<RAIN id="rain0" rate="0.0" total="123.4" delta="0.0" lowbat="0" '
+        b'date="20191231120000"/>'
+        b'<UV id="uv0" index="2.1" lowbat="0" date="20191231120000"/>'
+        b'<SOL id="sol0" rad="350" evo="0.12" lowbat="0" '
+        b'date="20191231120000"/>'
+        b'</logger>',
+        b'<logger>\n'
+        b'  <TH id="th0" temp="-3.4" hum="92" dew="-4.5" lowbat="0"/>\n'
+        b'  <TH id="th1" temp="18.0" hum="40" dew="4.2" lowbat="1"/>\n'
+        b'  <WIND id="wind0" dir="0" gust="0.0" wind="0.0" chill="-3.4"/>\n'
+        b'  <RAIN id="rain0" rate="2.4" total="0.2" delta="0.2"/>\n'
+        b'</logger>\n',
+        ]
+
+
+# Compare the fast parsers against the reference and time them. Recorded
+# documents can be passed as file names, otherwise the built in samples
+# are used.
+if __name__ == "__main__":
+    import sys
+    import timeit
+
+    documents = SAMPLE_DOCUMENTS
+    if len(sys.argv) > 1:
+        documents = []
+        for name in sys.argv[1:]:
+            with open(name, 'rb') as f:
+                documents.append(f.read())
+
+    failed = False
+    for n, doc in enumerate(documents):
+        reference = parse_etree(doc)
+        for name in PARSERS:
+            if PARSERS[name](doc) != reference:
+                print('document %d: %s differs from etree' % (n, name))
+                failed = True
+
+    count = 2000
+    for name in sorted(PARSERS):
+        parser = PARSERS[name]
+        elapsed = timeit.timeit(
+                lambda: [parser(doc) for doc in documents], number=count)
+        print('%-6s %8.1f us/document' %
+                (name, elapsed * 1e6 / (count * len(documents))))
+
+    sys.exit(1 if failed else 0)
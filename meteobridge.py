@@ -5,6 +5,8 @@ Copyright (c) 2018 Robert Paauwe
 """
 import polyinterface
 import sys
+import copy
+import logging
 import time
 import datetime
 import urllib3
@@ -13,10 +15,18 @@ import socket
 import math
 import threading
 import struct
-import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import ParseError
 import write_profile
 import uom
+import publish
+import breaker
+import mbparse
+import pipeline
+import snapshot
+import validate
+import snapserver
+import records
+import flightrec
+import integrate
 
 LOGGER = polyinterface.LOGGER
 
@@ -37,6 +47,56 @@ class Controller(polyinterface.Controller):
         self.light_list = {}
         self.lightning_list = {}
         self.myConfig = {}  # custom parameters
+        self.publisher = publish.PublishQueue(self.send_driver,
+                self.link_up, LOGGER)
+        self.snapshot = snapshot.DriverSnapshot()
+        self.query_version = None   # None, the next query reports all
+        self.was_up = False
+        self.breaker = breaker.CircuitBreaker()
+        self.health = None
+        self.timeout = 10
+        self.parser = mbparse.get_parser(mbparse.DEFAULT_PARSER)
+        self.derived = []
+        self.sample = records.Sample()
+        self.validator = validate.Validator(LOGGER)
+
+        self.flightrec = flightrec.FlightRecorder(LOGGER)
+        self.pipeline = pipeline.Pipeline(LOGGER)
+        self.pipeline.on_error = self.flightrec.error
+        self.publisher.on_failure = \
+                lambda node, driver, err: self.flightrec.error('publish', err)
+        self.pipeline.add_stage('parse',
+                lambda s: pipeline.parse(s, self.parser, LOGGER,
+                    self.flightrec.error))
+        self.pipeline.add_stage('normalize',
+                lambda s: pipeline.normalize(s, LOGGER, self.sample))
+        self.pipeline.add_stage('validate',
+                lambda s: validate.validate(s, self.validator))
+        self.pipeline.add_stage('derive',
+                lambda s: pipeline.derive(s, self.derived))
+        self.integrators = integrate.Integrators(LOGGER)
+        self.pipeline.add_stage('integrate',
+                lambda s: integrate.integrate(s, self.integrators))
+        self.pipeline.add_sink('publish', self.publish_sample)
+
+        # Share the data with other local consumers.
+        self.history = snapserver.History()
+        self.pipeline.add_sink('history', self.history)
+        self.server = snapserver.SnapshotServer(self.snapshot, self.metrics,
+                LOGGER, self.history)
+        self.recorder = None
+        self.recorder_sink = None
+        self.replay_file = None
+        self.replay_speed = 100.0
+        self.replay_thread = None
+        self.replay_cancel = threading.Event()
+        self.replaying = threading.Event()
+        self.registered = False
+        self.startup_nodes = []
+        self.startup_lock = threading.Lock()
+        self.startup_thread = None
+        self.startup_time = time.time()
+        self.startup_timings = []
 
         self.poly.onConfig(self.process_config)
 
@@ -60,107 +120,216 @@ class Controller(polyinterface.Controller):
                     self.addNotice("Port for the MeteoBridge device is required (default is 5557).")
 
     def start(self):
+        # Get the first sample out as quickly as possible. Only the
+        # configuration is handled here, the node objects are created
+        # locally, then the profile, node registration and custom
+        # parameters are handled in the background while the first poll
+        # is made. Its values wait in the publish queue until the nodes
+        # are registered.
         LOGGER.info('Starting MeteoBridge Node Server')
-        self.check_params()
-        self.discover()
+        self.startup_time = time.time()
+        self.set_configuration(self.polyConfig)
+        self.myConfig = self.polyConfig['customParams']
+        self.configure_drivers(self.units)
+        self.startup_nodes = self.build_nodes()
+        for node in self.startup_nodes:
+            self.nodes[node.address] = node
+        self.startup_phase('configure')
+
+        self.start_finish()
+
+        self.longPoll()
+        self.startup_phase('first poll')
+
+    def start_finish(self):
+        self.startup_thread = threading.Thread(target=self.finish_start,
+                name='startup')
+        self.startup_thread.daemon = True
+        self.startup_thread.start()
+
+    def finish_start(self):
+        try:
+            self.setup_profile()
+            self.startup_phase('profile')
+            for node in self.startup_nodes:
+                self.addNode(node)
+            self.startup_phase('nodes')
+            self.check_params()
+            self.startup_phase('params')
+        except Exception as err:
+            # Updates stay queued, shortPoll tries again.
+            LOGGER.error('Startup failed: %s', err, exc_info=True)
+            return
+
+        # Nodes exist now, let the updates held since the first poll out.
+        self.registered = True
+        self.publisher.drain(self.publisher.backlog())
+        self.startup_phase('first publish')
         LOGGER.info('MeteoBridge Node Server Started.')
 
+    def startup_phase(self, name):
+        # A retried startup replaces the earlier timing of a phase.
+        elapsed = time.time() - self.startup_time
+        with self.startup_lock:
+            self.startup_timings = [t for t in self.startup_timings
+                    if t[0] != name]
+            self.startup_timings.append((name, elapsed))
+        LOGGER.info('Startup: %s done after %.3f seconds', name, elapsed)
+
     def shortPoll(self):
-        pass
+        # Retry a startup that failed to register the nodes.
+        if not self.registered and self.startup_thread is not None and \
+                not self.startup_thread.is_alive():
+            LOGGER.info('Retrying node server startup.')
+            self.start_finish()
+
+        self.check_link()
+
+        # Push out anything that was queued while Polyglot was unreachable.
+        if self.publisher.backlog() > 0:
+            sent = self.publisher.drain()
+            LOGGER.debug('Drained %d queued updates, %d remaining.',
+                    sent, self.publisher.backlog())
+
+    def check_link(self):
+        # The ISY may have lost the driver values while the link was
+        # down, so the first query after it comes (back) up reports all.
+        up = self.link_up()
+        if up and not self.was_up:
+            self.query_version = None
+        self.was_up = up
+
+    def link_up(self):
+        return self.registered and getattr(self.poly, 'connected', True)
+
+    def send_driver(self, node, driver, value):
+        # Bypass the node's setDriver override, the value has already
+        # been converted to the configured units.
+        polyinterface.Node.setDriver(node, driver, value, report=True,
+                force=True)
 
     def longPoll(self):
-        # open socket and read data
         if self.ip == "" or self.port == "":
             return
 
+        # The timings are recorded even when the poll failed, before
+        # any error marked during it is written out. Publish failures
+        # from shortPoll are written with the next poll.
+        count = self.pipeline.run(self.fetch_documents())
+        timings = {name: t['last']
+                for name, t in self.pipeline.stats().items()}
+        self.flightrec.timings(timings)
+        self.flightrec.flush()
+        if count == 0:
+            return
+
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            for name in timings:
+                LOGGER.debug('stage %-10s %8.3f ms', name,
+                        timings[name] * 1000)
+
+    def fetch_documents(self):
+        # Don't bother trying if the device has been failing, the breaker
+        # will let a probe through once the backoff delay has passed.
+        if not self.breaker.allow():
+            return
+
+        state = self.breaker.state
+        try:
+            xmldata = self.fetch()
+        except Exception as err:
+            self.breaker.failure()
+            if self.breaker.failures == 1:
+                LOGGER.error('Failure trying to connect to MeteoBridge device: %s', err)
+            if self.breaker.state == breaker.OPEN and state != breaker.OPEN:
+                LOGGER.warning('MeteoBridge device unreachable after %d attempts, next try in %d seconds.',
+                        self.breaker.failures, self.breaker.delay)
+            self.update_health()
+            return
+
+        if state != breaker.CLOSED:
+            LOGGER.info('MeteoBridge device is reachable again.')
+        self.breaker.success()
+        self.update_health()
+
+        self.flightrec.record(xmldata)
+        LOGGER.debug('MeteoBridge data: %s', xmldata)
+        yield xmldata
+
+    def fetch(self):
+        # open socket and read data
+        sock = socket.create_connection((self.ip, self.port),
+                timeout=self.timeout)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            mb_address = (self.ip, self.port)
-            sock.connect(mb_address)
             header = "Content-type: text/xml; charset=UTF-8\n\n"
             sock.sendall(header.encode())
-            xmldata = sock.recv(2048)
-
-            LOGGER.debug(xmldata)
-            # Parse the XML data
-            try:
-                tree = ET.XML(xmldata.decode())
-
-                LOGGER.debug('tag = ' + tree.tag)
-                for child in tree.getchildren():
-                    LOGGER.debug('   child = ' + child.tag)
-                    if child.tag == 'UV':
-                        self.nodes['light'].setDriver(
-                           uom.LITE_DRVS['uv'], float(child.get('index')))
-                        LOGGER.debug('    UV index = ' + child.get('index'))
-                    elif child.tag == 'SOL':
-                        LOGGER.debug('    Solar   = ' + child.get('rad'))
-                        self.nodes['light'].setDriver(
-                            uom.LITE_DRVS['solar_radiation'],
-                            float(child.get('rad')))
-                        if child.get('evo') != None:
-                            LOGGER.debug('    Evaptranspiration = ' + child.get('evo'))
-                    elif child.tag == 'RAIN':
-                        if child.get('id') == 'rain0':
-                            LOGGER.debug('    Rate    = ' + child.get('rate'))
-                            LOGGER.debug('    Delta   = ' + child.get('delta'))
-                            LOGGER.debug('    Total   = ' + child.get('total'))
-                            self.nodes['rain'].setDriver(
-                                uom.RAIN_DRVS['rate'], float(child.get('rate')))
-                            self.nodes['rain'].setDriver(
-                                uom.RAIN_DRVS['total'], float(child.get('total')))
-                    elif child.tag == 'TH':
-                        if child.get('id') == 'th0':
-                            self.nodes['temperature'].setDriver(
-                                uom.TEMP_DRVS['dewpoint'],
-                                float(child.get('dew')))
-                            self.nodes['temperature'].setDriver(
-                                uom.TEMP_DRVS['main'], float(child.get('temp')))
-                            self.nodes['humidity'].setDriver(
-                                uom.HUMD_DRVS['main'], float(child.get('hum')))
-                            LOGGER.debug('    Dewpoin = ' + child.get('dew'))
-                            LOGGER.debug('    Humidit = ' + child.get('hum'))
-                            LOGGER.debug('    Temp    = ' + child.get('temp'))
-                    elif child.tag == 'THB':
-                        if child.get('id') == 'thb0':
-                            self.nodes['pressure'].setDriver(
-                                uom.PRES_DRVS['station'], float(child.get('press')))
-                            self.nodes['pressure'].setDriver(
-                                uom.PRES_DRVS['sealevel'],
-                                float(child.get('seapress')))
-                            LOGGER.debug('    Dewpoin = ' + child.get('dew'))
-                            LOGGER.debug('    Humidit = ' + child.get('hum'))
-                            LOGGER.debug('    Temp    = ' + child.get('temp'))
-                            LOGGER.debug('    Sea     = ' + child.get('seapress'))
-                            LOGGER.debug('    pressur = ' + child.get('press'))
-                    elif child.tag == 'WIND':
-                        if child.get('id') == 'wind0':
-                            self.nodes['temperature'].setDriver(
-                                uom.TEMP_DRVS['windchill'],
-                                float(child.get('chill')))
-                            self.nodes['wind'].setDriver(
-                                uom.WIND_DRVS['windspeed'], float(child.get('wind')))
-                            self.nodes['wind'].setDriver(
-                                uom.WIND_DRVS['gustspeed'], float(child.get('gust')))
-                            self.nodes['wind'].setDriver(
-                                uom.WIND_DRVS['winddir'], float(child.get('dir')))
-                            LOGGER.debug('    chill   = ' + child.get('chill'))
-                            LOGGER.debug('    wind    = ' + child.get('wind'))
-                            LOGGER.debug('    gust    = ' + child.get('gust'))
-                            LOGGER.debug('    direct  = ' + child.get('dir'))
-
-            except:
-                LOGGER.error("Failure while parsing MeteoBridge data.")
-        except:
-            LOGGER.error("Failure trying to connect to MeteoBridge device.")
+            return sock.recv(2048)
         finally:
             sock.close()
 
-    def query(self):
-        for node in self.nodes:
-            self.nodes[node].reportDrivers()
-
-    def discover(self, *args, **kwargs):
+    def publish_sample(self, sample, replay=False):
+        # Live samples are held back while a recording is replayed so
+        # the two don't fight over the drivers.
+        if self.replaying.is_set() and not replay:
+            return
+        for (address, key), value in sample.items():
+            # Some values, like the evapotranspiration rate, are only
+            # inputs for other values and have no driver.
+            if address in self.nodes and key in uom.NODE_DRVS[address]:
+                self.nodes[address].setDriver(uom.NODE_DRVS[address][key],
+                        value)
+
+    def update_health(self):
+        # Reflect the connection state in the controller drivers. Only
+        # publish when something changed.
+        health = (0 if self.breaker.state == breaker.OPEN else 1,
+                self.breaker.state, self.breaker.failures)
+        if health == self.health:
+            return
+        self.health = health
+        self.publish(self, 'ST', health[0])
+        self.publish(self, 'GV1', health[1])
+        self.publish(self, 'GV2', health[2])
+
+    def publish(self, node, driver, value):
+        # All driver updates come through here so the snapshot always
+        # holds the latest value, even while Polyglot is unreachable.
+        self.snapshot.update(node.address, driver, value)
+        self.publisher.publish(node, driver, value)
+
+    def query(self, command=None):
+        # Answer from the snapshot. The first query after a (re)connect
+        # reports every driver of every node, including the ones never
+        # published, after that only the drivers that changed since the
+        # previous query.
+        self.check_link()
+        count = 0
+        if self.query_version is None:
+            cached, version = self.snapshot.nodes()
+            nodes = dict(self.nodes)
+            nodes.setdefault(self.address, self)
+            for address, node in nodes.items():
+                values = cached.get(address, {})
+                for d in node.drivers:
+                    driver = d['driver']
+                    value = values[driver][0] if driver in values \
+                            else d['value']
+                    self.publisher.publish(node, driver, value)
+                    count += 1
+        else:
+            changes, version = self.snapshot.changed_since(
+                    self.query_version)
+            for (address, driver), value in reversed(changes):
+                node = self if address == self.address else \
+                        self.nodes.get(address)
+                if node is not None:
+                    self.publisher.publish(node, driver, value)
+                    count += 1
+        LOGGER.debug('Query: reported %d drivers, version %s to %d', count,
+                self.query_version, version)
+        self.query_version = version
+
+    def build_nodes(self):
         """
         Add nodes for basic sensor type data
                 - Temperature (temp, dewpoint, heat index, wind chill, feels)
@@ -174,8 +343,11 @@ class Controller(polyinterface.Controller):
         The nodes need to have thier drivers configured based on the user
         supplied configuration. To that end, we should probably create the
         node, update the driver list, set the units and then add the node.
+
+        This only creates the node objects, discover() adds them.
         """
         LOGGER.info("Creating nodes.")
+        nodes = []
         node = TemperatureNode(self, self.address, 'temperature', 'Temperatures')
         node.SetUnits(self.units);
         for d in self.temperature_list:
@@ -185,7 +357,21 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.temperature_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
+
+        # Values we calculate when the MeteoBridge doesn't report them.
+        main = ('temperature', 'main')
+        humidity = ('humidity', 'main')
+        self.derived = []
+        if 'dewpoint' in self.temperature_list:
+            self.derived.append((('temperature', 'dewpoint'),
+                [main, humidity], node.Dewpoint))
+        if 'heatindex' in self.temperature_list:
+            self.derived.append((('temperature', 'heatindex'),
+                [main, humidity], node.Heatindex))
+        if 'apparent' in self.temperature_list:
+            self.derived.append((('temperature', 'apparent'),
+                [main, ('wind', 'windspeed'), humidity], node.ApparentTemp))
 
         node = HumidityNode(self, self.address, 'humidity', 'Humidity')
         node.SetUnits(self.units);
@@ -196,7 +382,7 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.humidity_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
 
         node = PressureNode(self, self.address, 'pressure', 'Barometric Pressure')
         node.SetUnits(self.units);
@@ -207,7 +393,7 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.pressure_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
 
         node = WindNode(self, self.address, 'wind', 'Wind')
         node.SetUnits(self.units);
@@ -218,7 +404,7 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.wind_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
 
         node = PrecipitationNode(self, self.address, 'rain', 'Precipitation')
         node.SetUnits(self.units);
@@ -229,7 +415,7 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.rain_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
 
         node = LightNode(self, self.address, 'light', 'Illumination')
         node.SetUnits(self.units);
@@ -240,20 +426,48 @@ class Controller(polyinterface.Controller):
                         'value': 0,
                         'uom': uom.UOM[self.light_list[d]]
                         })
-        self.addNode(node)
+        nodes.append(node)
+
+        return nodes
+
+    def discover(self, *args, **kwargs):
+        for node in self.build_nodes():
+            self.addNode(node)
 
     def delete(self):
         self.stopping = True
+        self.stop_replay()
+        self.server.stop()
         LOGGER.info('Removing MeteoBridge node server.')
 
     def stop(self):
         self.stopping = True
+        self.stop_replay()
+        self.server.stop()
+        self.integrators.save()
         LOGGER.debug('Stopping MeteoBridge node server.')
 
-    def check_params(self):
-        self.set_configuration(self.polyConfig)
-        self.setup_nodedefs(self.units)
+    def metrics(self):
+        # (name, labels, value) for the snapshot server /metrics page.
+        m = [('meteobridge_snapshot_version', None, self.snapshot.version)]
+        for k, v in self.publisher.stats().items():
+            m.append(('meteobridge_publish_' + k, None, v))
+        for k, v in self.breaker.stats().items():
+            m.append(('meteobridge_connection_' + k, None, v))
+        for (node, key), count in self.validator.rejected.items():
+            m.append(('meteobridge_rejected_total',
+                {'node': node, 'driver': key}, count))
+        for name, elapsed in self.startup_timings:
+            m.append(('meteobridge_startup_seconds', {'phase': name},
+                '%.3f' % elapsed))
+        for name, t in self.pipeline.stats().items():
+            m.append(('meteobridge_stage_items_total', {'stage': name},
+                t['items']))
+            m.append(('meteobridge_stage_seconds_total', {'stage': name},
+                '%.6f' % t['seconds']))
+        return m
 
+    def check_params(self):
         # Make sure they are in the params  -- does this cause a 
         # configuration event?
         LOGGER.info("Adding configuation")
@@ -263,8 +477,6 @@ class Controller(polyinterface.Controller):
                     'Units': self.units,
                     })
 
-        self.myConfig = self.polyConfig['customParams']
-
         # Remove all existing notices
         LOGGER.info("remove all notices")
         self.removeNoticesAll()
@@ -297,10 +509,139 @@ class Controller(polyinterface.Controller):
         else:
             self.units = 'metric'
 
+        # Which XML parser to use, see mbparse.PARSERS.
+        if 'Parser' in config['customParams']:
+            self.parser = mbparse.get_parser(config['customParams']['Parser'],
+                    LOGGER)
+        else:
+            self.parser = mbparse.get_parser(mbparse.DEFAULT_PARSER)
+
+        # Optional local HTTP server for the latest data.
+        http_port = config['customParams'].get('HTTPPort', '')
+        http_bind = config['customParams'].get('HTTPBind', '') or '127.0.0.1'
+        if http_port != '':
+            try:
+                port = int(http_port)
+                if not 0 < port < 65536:
+                    raise ValueError('out of range')
+            except ValueError:
+                LOGGER.error('Invalid HTTPPort %r, snapshot server disabled.',
+                        http_port)
+                self.server.stop()
+            else:
+                self.server.start(port, http_bind)
+        else:
+            self.server.stop()
+
+        # Optional recording of every sample and replay of a recording.
+        self.set_recorder(config['customParams'].get('HistoryFile', ''))
+        # A replay only starts when ReplayFile is changed, not on every
+        # restart with it set. The REPLAY command starts it again.
+        replay_file = config['customParams'].get('ReplayFile', '')
+        replay_speed = config['customParams'].get('ReplaySpeed', '')
+        try:
+            self.replay_speed = float(replay_speed) if replay_speed != '' \
+                    else 100.0
+        except ValueError:
+            LOGGER.warning('Invalid ReplaySpeed %r, using 100.', replay_speed)
+            self.replay_speed = 100.0
+        changed = (self.replay_file is not None and
+                replay_file != self.replay_file)
+        self.replay_file = replay_file
+        if changed:
+            self.stop_replay()
+            if replay_file != '':
+                self.start_replay()
+
         return self.units
 
+    def set_recorder(self, path):
+        if self.recorder is not None:
+            if self.recorder.path == path:
+                return
+            self.pipeline.remove_sink('recorder')
+            self.recorder_sink.stop()
+            self.recorder.close()
+            self.recorder = None
+            self.recorder_sink = None
+
+        if path != '':
+            try:
+                self.recorder = records.CsvRecorder(path)
+            except OSError as err:
+                LOGGER.error('Unable to record history to %s: %s', path, err)
+                return
+            self.recorder_sink = pipeline.AsyncSink('recorder', self.recorder,
+                    LOGGER)
+            self.pipeline.add_sink('recorder', self.recorder_sink)
+
+    def start_replay(self, command=None):
+        if not self.replay_file:
+            LOGGER.error('Replay: no ReplayFile configured.')
+            return
+        self.stop_replay()
+        self.replay_cancel.clear()
+        self.replaying.set()
+        self.replay_thread = threading.Thread(target=self.replay,
+                args=(self.replay_file, self.replay_speed), name='replay')
+        self.replay_thread.daemon = True
+        self.replay_thread.start()
+
+    def stop_replay(self, command=None):
+        if self.replay_thread is not None:
+            self.replay_cancel.set()
+            self.replay_thread.join()
+            self.replay_thread = None
+
+    def replay(self, path, speed):
+        # Push a recording through the publish path, speed times faster
+        # than it was recorded. Used to exercise ISY programs. Live
+        # samples aren't published until it is done or cancelled.
+        try:
+            self.replay_samples(path, speed)
+        finally:
+            self.replaying.clear()
+
+    def replay_samples(self, path, speed):
+        try:
+            import backfill
+        except ImportError:
+            LOGGER.error('Replay needs numpy, which is not installed.')
+            return
+
+        try:
+            timestamps, columns = backfill.load(path)
+        except Exception as err:
+            LOGGER.error('Unable to load %s: %s', path, err)
+            return
+
+        # Only replay the drivers the nodes are configured with.
+        lists = {
+                'temperature': self.temperature_list,
+                'humidity': self.humidity_list,
+                'pressure': self.pressure_list,
+                'wind': self.wind_list,
+                'rain': self.rain_list,
+                'light': self.light_list,
+                }
+        columns = {k: v for k, v in backfill.derive(columns).items()
+                if k[1] in lists.get(k[0], {})}
+
+        LOGGER.info('Replaying %d samples from %s at %gx.',
+                len(timestamps), path, speed)
+        rate = backfill.replay(timestamps, columns,
+                lambda sample: self.publish_sample(sample, replay=True),
+                speed, stop=self.replay_cancel)
+        if self.replay_cancel.is_set():
+            LOGGER.info('Replay of %s cancelled.', path)
+        else:
+            LOGGER.info('Replay of %s done, %.0f samples/second.', path, rate)
+
     def setup_nodedefs(self, units):
+        self.configure_drivers(units)
+        self.setup_profile()
 
+    def configure_drivers(self, units):
         # Configure the units for each node driver
         self.temperature_list['main'] = 'I_TEMP_F' if units == 'us' else 'I_TEMP_C'
         self.temperature_list['dewpoint'] = 'I_TEMP_F' if units == 'us' else 'I_TEMP_C'
@@ -315,18 +656,31 @@ class Controller(polyinterface.Controller):
         self.rain_list['total'] = 'I_MM' if units == 'metric' else 'I_INCHES'
         self.light_list['uv'] = 'I_UV'
         self.light_list['solar_radiation'] = 'I_RADIATION'
+        self.light_list['solar_energy'] = 'I_SOLAR_ENERGY'
+        self.light_list['solar_energy_total'] = 'I_SOLAR_ENERGY'
+        self.light_list['evapotranspiration'] = 'I_INCHES' if units == 'us' else 'I_MM'
+        self.light_list['evapotranspiration_total'] = 'I_INCHES' if units == 'us' else 'I_MM'
 
+    def setup_profile(self):
         # Build the node definition
         LOGGER.info('Creating node definition profile based on config.')
-        write_profile.write_profile(LOGGER, self.temperature_list,
+        st = write_profile.write_profile(LOGGER, self.temperature_list,
                 self.humidity_list, self.pressure_list, self.wind_list,
                 self.rain_list, self.light_list, self.lightning_list)
+        if st == write_profile.CACHED:
+            # Same profile as last time, the ISY already has it.
+            return
 
         # push updated profile to ISY
         try:
             self.poly.installprofile()
         except:
             LOGGER.error('Failed up push profile to ISY')
+            return
+
+        write_profile.installed(LOGGER, self.temperature_list,
+                self.humidity_list, self.pressure_list, self.wind_list,
+                self.rain_list, self.light_list, self.lightning_list)
 
     def remove_notices_all(self,command):
         LOGGER.info('remove_notices_all:')
@@ -350,12 +704,16 @@ class Controller(polyinterface.Controller):
     commands = {
         'DISCOVER': discover,
         'UPDATE_PROFILE': update_profile,
-        'REMOVE_NOTICES_ALL': remove_notices_all
+        'REMOVE_NOTICES_ALL': remove_notices_all,
+        'REPLAY': start_replay,
+        'REPLAY_STOP': stop_replay,
     }
     # Hub status information here: battery and rssi values.
     drivers = [
             {'driver': 'ST', 'value': 1, 'uom': 2},
             {'driver': 'GV0', 'value': 0, 'uom': 72}, 
+            {'driver': 'GV1', 'value': 0, 'uom': 25},
+            {'driver': 'GV2', 'value': 0, 'uom': 56},
             ]
 
 
@@ -365,6 +723,10 @@ class TemperatureNode(polyinterface.Node):
     units = 'metric'
     drivers = [ ]
 
+    def __init__(self, controller, primary, address, name):
+        super(TemperatureNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+
     def SetUnits(self, u):
         self.units = u
 
@@ -415,7 +777,7 @@ class TemperatureNode(polyinterface.Node):
         if (self.units == "us"):
             value = (value * 1.8) + 32  # convert to F
 
-        super(TemperatureNode, self).setDriver(driver, round(value, 1), report=True, force=True)
+        self.controller.publish(self, driver, round(value, 1))
 
 
 
@@ -425,19 +787,26 @@ class HumidityNode(polyinterface.Node):
     units = 'metric'
     drivers = [{'driver': 'ST', 'value': 0, 'uom': 22}]
 
+    def __init__(self, controller, primary, address, name):
+        super(HumidityNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+
     def SetUnits(self, u):
         self.units = u
 
     def setDriver(self, driver, value):
-        super(HumidityNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publish(self, driver, value)
 
 class PressureNode(polyinterface.Node):
     id = 'pressure'
     hint = 0xffffff
     units = 'metric'
     drivers = [ ]
-    mytrend = []
 
+    def __init__(self, controller, primary, address, name):
+        super(PressureNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+        self.trend = records.PressureTrend(180)
 
     def SetUnits(self, u):
         self.units = u
@@ -459,13 +828,7 @@ class PressureNode(polyinterface.Node):
     # track pressures in a queue and calculate trend
     def updateTrend(self, current):
         t = 0
-        past = 0
-
-        if len(self.mytrend) == 180:
-            past = self.mytrend.pop()
-
-        if self.mytrend != []:
-            past = self.mytrend[0]
+        past = self.trend.newest()
 
         # calculate trend
         if ((past - current) > 1):
@@ -473,7 +836,7 @@ class PressureNode(polyinterface.Node):
         elif ((past - current) < -1):
             t = 1
 
-        self.mytrend.insert(0, current)
+        self.trend.add(current)
         return t
 
     # We want to override the SetDriver method so that we can properly
@@ -481,7 +844,7 @@ class PressureNode(polyinterface.Node):
     def setDriver(self, driver, value):
         if (self.units == 'us'):
             value = round(value * 0.02952998751, 3)
-        super(PressureNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publish(self, driver, value)
 
 
 class WindNode(polyinterface.Node):
@@ -490,6 +853,10 @@ class WindNode(polyinterface.Node):
     units = 'metric'
     drivers = [ ]
 
+    def __init__(self, controller, primary, address, name):
+        super(WindNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+
     def SetUnits(self, u):
         self.units = u
 
@@ -498,58 +865,54 @@ class WindNode(polyinterface.Node):
             # Metric value is meters/sec (not KPH)
             if (self.units != 'metric'):
                 value = round(value * 2.23694, 2)
-        super(WindNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publish(self, driver, value)
 
 class PrecipitationNode(polyinterface.Node):
     id = 'precipitation'
     hint = 0xffffff
     units = 'metric'
     drivers = [ ]
-    hourly_rain = 0
-    daily_rain = 0
-    weekly_rain = 0
-    monthly_rain = 0
-    yearly_rain = 0
 
-    prev_hour = 0
-    prev_day = 0
-    prev_week = 0
+    def __init__(self, controller, primary, address, name):
+        super(PrecipitationNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+        self.rain = records.RainTotals()
 
     def SetUnits(self, u):
         self.units = u
 
     def hourly_accumulation(self, r):
         current_hour = datetime.datetime.now().hour
-        if (current_hour != self.prev_hour):
-            self.prev_hour = current_hour
-            self.hourly = 0
+        if (current_hour != self.rain.prev_hour):
+            self.rain.prev_hour = current_hour
+            self.rain.hourly = 0
 
-        self.hourly_rain += r
-        return self.hourly_rain
+        self.rain.hourly += r
+        return self.rain.hourly
 
     def daily_accumulation(self, r):
         current_day = datetime.datetime.now().day
-        if (current_day != self.prev_day):
-            self.prev_day = current_day
-            self.daily_rain = 0
+        if (current_day != self.rain.prev_day):
+            self.rain.prev_day = current_day
+            self.rain.daily = 0
 
-        self.daily_rain += r
-        return self.daily_rain
+        self.rain.daily += r
+        return self.rain.daily
 
     def weekly_accumulation(self, r):
-        current_week = datetime.datetime.now().day
-        if (current_weekday != self.prev_weekday):
-            self.prev_week = current_weekday
-            self.weekly_rain = 0
+        current_week = datetime.datetime.now().isocalendar()[1]
+        if (current_week != self.rain.prev_week):
+            self.rain.prev_week = current_week
+            self.rain.weekly = 0
 
-        self.weekly_rain += r
-        return self.weekly_rain
+        self.rain.weekly += r
+        return self.rain.weekly
 
         
     def setDriver(self, driver, value):
         if (self.units == 'us'):
             value = round(value * 0.03937, 2)
-        super(PrecipitationNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publish(self, driver, value)
 
 class LightNode(polyinterface.Node):
     id = 'light'
@@ -557,11 +920,23 @@ class LightNode(polyinterface.Node):
     hint = 0xffffff
     drivers = [ ]
 
+    def __init__(self, controller, primary, address, name):
+        super(LightNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+
     def SetUnits(self, u):
         self.units = u
 
     def setDriver(self, driver, value):
-        super(LightNode, self).setDriver(driver, value, report=True, force=True)
+        if (driver == 'GV2' or driver == 'GV3'):
+            value = round(value, 3)
+        elif (driver == 'GV4' or driver == 'GV5'):
+            # evapotranspiration in mm
+            if (self.units == 'us'):
+                value = round(value * 0.03937, 3)
+            else:
+                value = round(value, 2)
+        self.controller.publish(self, driver, value)
 
 class LightningNode(polyinterface.Node):
     id = 'lightning'
@@ -569,6 +944,10 @@ class LightningNode(polyinterface.Node):
     units = 'metric'
     drivers = [ ]
 
+    def __init__(self, controller, primary, address, name):
+        super(LightningNode, self).__init__(controller, primary, address, name)
+        self.drivers = copy.deepcopy(self.drivers)
+
     def SetUnits(self, u):
         self.units = u
 
@@ -576,7 +955,7 @@ class LightningNode(polyinterface.Node):
         if (driver == 'GV0'):
             if (self.units != 'metric'):
                 value = round(value / 1.609344, 1)
-        super(LightningNode, self).setDriver(driver, value, report=True, force=True)
+        self.controller.publish(self, driver, value)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Staged processing pipeline for MeteoBridge data.
+Copyright (c) 2018 Robert Paauwe
+
+A poll flows through a chain of generator stages:
+
+  fetch -> parse -> normalize -> derive -> sinks (publish, ...)
+
+  fetch      yields raw documents
+  parse      yields a list of (tag, id, attrs) records per document
+  normalize  yields a sample per document, a records.Sample mapping
+             (node, driver key) to a metric value, e.g.
+             sample[('temperature', 'main')] = 21.3
+  derive     adds calculated values to the sample
+
+Each stage is a function that takes an iterable and returns an iterable
+so stages can be tested on their own and extra filters can be inserted
+anywhere in the chain. Samples coming out of the last stage are handed
+to every sink. The same Sample object is reused for every document, so
+a sink that wants to keep it has to copy it. A sink that may be slow
+should be wrapped in an AsyncSink so that it can never hold up a poll.
+"""
+import queue
+import threading
+import time
+
+
+# Map the MeteoBridge records to node drivers. For each record tag, the
+# sensor id we care about (None for any) and the list of
+# (attribute, node, driver key) values it provides.
+RECORD_MAP = {
+        'UV': (None, [('index', 'light', 'uv')]),
+        'SOL': (None, [
+            ('rad', 'light', 'solar_radiation'),
+            ('evo', 'light', 'evo')]),
+        'RAIN': ('rain0', [
+            ('rate', 'rain', 'rate'),
+            ('total', 'rain', 'total')]),
+        'TH': ('th0', [
+            ('dew', 'temperature', 'dewpoint'),
+            ('temp', 'temperature', 'main'),
+            ('hum', 'humidity', 'main')]),
+        'THB': ('thb0', [
+            ('press', 'pressure', 'station'),
+            ('seapress', 'pressure', 'sealevel')]),
+        'WIND': ('wind0', [
+            ('chill', 'temperature', 'windchill'),
+            ('wind', 'wind', 'windspeed'),
+            ('gust', 'wind', 'gustspeed'),
+            ('dir', 'wind', 'winddir')]),
+        }
+
+
+def parse(stream, parser, logger, on_error=None):
+    for document in stream:
+        try:
+            yield parser(document)
+        except Exception as err:
+            logger.error('Failure while parsing MeteoBridge data: %s', err)
+            if on_error is not None:
+                on_error('parse', err)
+
+
+def normalize(stream, logger, sample):
+    for records in stream:
+        sample.clear(time.time())
+        for tag, sid, attrs in records:
+            if tag not in RECORD_MAP:
+                continue
+            want, fields = RECORD_MAP[tag]
+            if want is not None and sid != want:
+                continue
+            for attr, node, key in fields:
+                try:
+                    sample[(node, key)] = float(attrs[attr])
+                except (KeyError, TypeError, ValueError):
+                    logger.debug('%s/%s: missing or bad %s', tag, sid, attr)
+        yield sample
+
+
+def derive(stream, rules):
+    # rules is a list of (key, inputs, function). The value is only
+    # calculated when all the inputs are present and the sample doesn't
+    # already provide it.
+    for sample in stream:
+        for key, inputs, function in rules:
+            if key in sample:
+                continue
+            try:
+                sample[key] = function(*[sample[i] for i in inputs])
+            except (KeyError, ValueError, ZeroDivisionError):
+                pass
+        yield sample
+
+
+class AsyncSink(object):
+    # Run a sink on its own thread, fed through a bounded queue. When
+    # the sink can't keep up, new samples are dropped and counted rather
+    # than blocking the pipeline.
+    def __init__(self, name, sink, logger, maxsize=100):
+        self.name = name
+        self.sink = sink
+        self.logger = logger
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, sample):
+        try:
+            self.queue.put_nowait(sample.copy())
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        # Let the thread finish the queued samples and exit. The sink
+        # must already be removed from the pipeline.
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            sample = self.queue.get()
+            if sample is None:
+                break
+            try:
+                self.sink(sample)
+            except Exception as err:
+                self.logger.error('%s sink failed: %s', self.name, err)
+
+
+class Pipeline(object):
+    def __init__(self, logger):
+        self.logger = logger
+        self.stages = []
+        self.sinks = []
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.on_error = None   # on_error(stage name, exception)
+
+    def _index(self, name):
+        for i, stage in enumerate(self.stages):
+            if stage[0] == name:
+                return i
+        raise KeyError(name)
+
+    def add_stage(self, name, stage, before=None, after=None):
+        # stage(iterable) -> iterable
+        if before is not None:
+            self.stages.insert(self._index(before), (name, stage))
+        elif after is not None:
+            self.stages.insert(self._index(after) + 1, (name, stage))
+        else:
+            self.stages.append((name, stage))
+
+    def remove_stage(self, name):
+        del self.stages[self._index(name)]
+
+    def add_sink(self, name, sink):
+        self.sinks.append((name, sink))
+
+    def remove_sink(self, name):
+        self.sinks = [s for s in self.sinks if s[0] != name]
+
+    def _timed(self, name, stream):
+        # An exception in a stage ends the stream here, reported under
+        # the stage's name, instead of escaping from run(). The stages
+        # after it see a normal end of the stream.
+        clock = time.perf_counter
+        it = iter(stream)
+        elapsed = 0.0
+        count = 0
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    elapsed += clock() - start
+                    break
+                except Exception as err:
+                    elapsed += clock() - start
+                    self.logger.error('%s stage failed: %s', name, err)
+                    if self.on_error is not None:
+                        self.on_error(name, err)
+                    break
+                elapsed += clock() - start
+                count += 1
+                yield item
+        finally:
+            self._record(name, count, elapsed)
+            # Let the stages upstream of a failure record their time now
+            # rather than whenever they are garbage collected.
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+
+    def _record(self, name, count, elapsed):
+        with self.lock:
+            t = self.timings.setdefault(name, [0, 0.0, 0.0])
+            t[0] += count
+            t[1] += elapsed
+            t[2] = elapsed
+
+    def run(self, source):
+        # Pull every sample through the stages and hand it to the sinks.
+        # Returns the number of samples processed. The 'last' timings
+        # start over, a stage or sink that doesn't run reports 0.
+        with self.lock:
+            for t in self.timings.values():
+                t[2] = 0.0
+        stream = self._timed('fetch', source)
+        for name, stage in self.stages:
+            stream = self._timed(name, stage(stream))
+
+        count = 0
+        for sample in stream:
+            count += 1
+            for name, sink in self.sinks:
+                start = time.perf_counter()
+                try:
+                    sink(sample)
+                except Exception as err:
+                    self.logger.error('%s sink failed: %s', name, err)
+                    if self.on_error is not None:
+                        self.on_error(name, err)
+                self._record(name, 1, time.perf_counter() - start)
+        return count
+
+    def stats(self):
+        # Time spent in each stage, excluding the time spent waiting on
+        # the stages before it.
+        names = ['fetch'] + [s[0] for s in self.stages]
+        stats = {}
+        with self.lock:
+            upstream = (0.0, 0.0)
+            for name in names:
+                items, total, last = self.timings.get(name, (0, 0.0, 0.0))
+                stats[name] = {
+                        'items': items,
+                        'seconds': total - upstream[0],
+                        'last': last - upstream[1],
+                        }
+                upstream = (total, last)
+            for name, sink in self.sinks:
+                items, total, last = self.timings.get(name, (0, 0.0, 0.0))
+                stats[name] = {'items': items, 'seconds': total, 'last': last}
+        return stats
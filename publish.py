@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Outbound publish queue for driver updates.
+Copyright (c) 2018 Robert Paauwe
+
+When the link to Polyglot is down, driver updates are held here instead
+of being pushed into polyinterface. Only the latest value for each
+(node, driver) pair is kept and the queue has a fixed upper bound, so a
+long outage costs a bounded amount of memory. Once the link is back the
+backlog is drained a few updates at a time.
+"""
+import collections
+import threading
+
+
+class PublishQueue(object):
+    def __init__(self, send, is_connected, logger, max_size=256,
+            drain_rate=25):
+        # send(node, driver, value) does the actual publish and
+        # is_connected() reports if the link to Polyglot is usable.
+        self.send = send
+        self.is_connected = is_connected
+        self.logger = logger
+        self.max_size = max_size
+        self.drain_rate = drain_rate
+
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.on_failure = None   # on_failure(node, driver, exception)
+
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.high_water = 0
+
+    def publish(self, node, driver, value):
+        # Fast path, nothing is waiting and the link is up so there is
+        # no need to queue the update.
+        if not self.pending and self.is_connected():
+            if self._send(node, driver, value):
+                return
+
+        # Otherwise it waits for the next drain(), which the controller
+        # calls from shortPoll so the backlog goes out at a fixed rate.
+        self._enqueue(node, driver, value)
+
+    def _enqueue(self, node, driver, value):
+        key = (node.address, driver)
+        with self.lock:
+            if key in self.pending:
+                # Only the latest value matters, replace the older one.
+                self.coalesced += 1
+                self.pending.move_to_end(key)
+            elif len(self.pending) >= self.max_size:
+                # Queue is full, throw away the stalest update.
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[key] = (node, value)
+            self.high_water = max(self.high_water, len(self.pending))
+
+    def _send(self, node, driver, value):
+        try:
+            self.send(node, driver, value)
+            self.published += 1
+            return True
+        except Exception as err:
+            self.failed += 1
+            self.logger.debug('publish of %s/%s failed: %s',
+                    node.address, driver, err)
+            if self.on_failure is not None:
+                self.on_failure(node, driver, err)
+            return False
+
+    def drain(self, limit=None):
+        # Publish up to limit queued updates, oldest first. Called
+        # periodically so that a large backlog is spread out over time
+        # instead of flooding the ISY when the link comes back.
+        if limit is None:
+            limit = self.drain_rate
+
+        count = 0
+        while count < limit and self.is_connected():
+            with self.lock:
+                if not self.pending:
+                    break
+                key, (node, value) = self.pending.popitem(last=False)
+
+            if not self._send(node, key[1], value):
+                # Put it back, unless a newer value arrived meanwhile.
+                with self.lock:
+                    if key not in self.pending:
+                        self.pending[key] = (node, value)
+                        self.pending.move_to_end(key, last=False)
+                break
+            count += 1
+
+        return count
+
+    def backlog(self):
+        return len(self.pending)
+
+    def stats(self):
+        return {
+                'backlog': len(self.pending),
+                'high_water': self.high_water,
+                'published': self.published,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                }
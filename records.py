@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Compact record types for samples and per node state.
+Copyright (c) 2018 Robert Paauwe
+
+A Sample holds one value for each of a fixed set of (node, driver key)
+fields in a preallocated array, plus a flag per field saying whether
+the value is present. It behaves like a small dict so the pipeline
+stages don't care, but it is cleared and refilled every poll instead of
+building new dicts and floats each time.
+"""
+import array
+import os
+import time
+
+# Every value a sample can carry, in metric units.
+FIELDS = (
+        ('temperature', 'main'),
+        ('temperature', 'dewpoint'),
+        ('temperature', 'windchill'),
+        ('temperature', 'heatindex'),
+        ('temperature', 'apparent'),
+        ('humidity', 'main'),
+        ('pressure', 'station'),
+        ('pressure', 'sealevel'),
+        ('wind', 'windspeed'),
+        ('wind', 'gustspeed'),
+        ('wind', 'winddir'),
+        ('rain', 'rate'),
+        ('rain', 'total'),
+        ('light', 'uv'),
+        ('light', 'solar_radiation'),
+        ('light', 'evo'),
+        ('light', 'solar_energy'),
+        ('light', 'solar_energy_total'),
+        ('light', 'evapotranspiration'),
+        ('light', 'evapotranspiration_total'),
+        )
+INDEX = {key: i for i, key in enumerate(FIELDS)}
+
+
+class Sample(object):
+    __slots__ = ('timestamp', 'values', 'present')
+
+    def __init__(self):
+        self.timestamp = 0.0
+        self.values = array.array('d', bytes(8 * len(FIELDS)))
+        self.present = bytearray(len(FIELDS))
+
+    def clear(self, timestamp=0.0):
+        self.timestamp = timestamp
+        self.present[:] = bytes(len(FIELDS))
+
+    def copy(self, into=None):
+        if into is None:
+            into = Sample()
+        into.timestamp = self.timestamp
+        into.values[:] = self.values
+        into.present[:] = self.present
+        return into
+
+    def __contains__(self, key):
+        i = INDEX.get(key)
+        return i is not None and self.present[i] == 1
+
+    def __getitem__(self, key):
+        i = INDEX[key]
+        if not self.present[i]:
+            raise KeyError(key)
+        return self.values[i]
+
+    def __setitem__(self, key, value):
+        i = INDEX[key]
+        self.values[i] = value
+        self.present[i] = 1
+
+    def __delitem__(self, key):
+        i = INDEX[key]
+        if not self.present[i]:
+            raise KeyError(key)
+        self.present[i] = 0
+
+    def __len__(self):
+        return sum(self.present)
+
+    def __iter__(self):
+        present = self.present
+        return (FIELDS[i] for i in range(len(FIELDS)) if present[i])
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        present = self.present
+        values = self.values
+        return [(FIELDS[i], values[i])
+                for i in range(len(FIELDS)) if present[i]]
+
+
+class SampleRing(object):
+    # Fixed number of preallocated samples, oldest overwritten first.
+    __slots__ = ('samples', 'next', 'count')
+
+    def __init__(self, size):
+        self.samples = [Sample() for i in range(size)]
+        self.next = 0
+        self.count = 0
+
+    def append(self, sample):
+        sample.copy(self.samples[self.next])
+        self.next = (self.next + 1) % len(self.samples)
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, len(self.samples))
+
+    def __iter__(self):
+        # oldest to newest
+        size = len(self.samples)
+        start = self.next if self.count >= size else 0
+        for i in range(len(self)):
+            yield self.samples[(start + i) % size]
+
+
+class PressureTrend(object):
+    # Ring buffer of the last size pressure readings.
+    __slots__ = ('values', 'next', 'count')
+
+    def __init__(self, size=180):
+        self.values = array.array('d', bytes(8 * size))
+        self.next = 0
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.next] = value
+        self.next = (self.next + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def newest(self, default=0):
+        if self.count == 0:
+            return default
+        return self.values[self.next - 1]
+
+
+class RainTotals(object):
+    # Rain accumulation counters and the period each one belongs to.
+    __slots__ = ('hourly', 'daily', 'weekly', 'monthly', 'yearly',
+            'prev_hour', 'prev_day', 'prev_week')
+
+    def __init__(self):
+        self.hourly = 0
+        self.daily = 0
+        self.weekly = 0
+        self.monthly = 0
+        self.yearly = 0
+        self.prev_hour = 0
+        self.prev_day = 0
+        self.prev_week = 0
+
+
+class CsvRecorder(object):
+    # Pipeline sink that appends every sample to a CSV file, one column
+    # per field, for backfill.py. Missing values are left empty.
+    def __init__(self, path):
+        self.path = path
+        header = ','.join(['time'] + ['%s.%s' % k for k in FIELDS])
+        try:
+            with open(path) as f:
+                old = f.readline().strip()
+        except (OSError, IOError):
+            old = ''
+        if old != '' and old != header:
+            # Recorded with a different set of fields, start a new file.
+            os.rename(path, '%s.%d' % (path, int(time.time())))
+            old = ''
+        self.file = open(path, 'a')
+        if old == '':
+            self.file.write(header + '\n')
+            self.file.flush()
+
+    def __call__(self, sample):
+        row = ['%.3f' % sample.timestamp]
+        for i in range(len(FIELDS)):
+            row.append(repr(sample.values[i]) if sample.present[i] else '')
+        self.file.write(','.join(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Read-only HTTP server for the latest MeteoBridge data.
+Copyright (c) 2018 Robert Paauwe
+
+Lets dashboards and scripts read the data the node server already has
+instead of each one polling the MeteoBridge itself.
+
+  /snapshot   latest driver values, JSON
+  /history    recent samples in metric units, JSON
+  /metrics    node server metrics, Prometheus text format
+
+JSON responses carry an ETag so clients can poll with If-None-Match and
+get a 304 when nothing changed. The versions behind the tags start over
+when the node server restarts, so the tags include a per process id.
+"""
+import json
+import socketserver
+import threading
+import time
+import records
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+START_ID = '%x' % int(time.time() * 1000)
+
+
+class History(object):
+    # The last size samples, used as a pipeline sink.
+    def __init__(self, size=360):
+        self.samples = records.SampleRing(size)
+        self.lock = threading.Lock()
+
+    def __call__(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+
+    @property
+    def count(self):
+        return self.samples.count
+
+    def to_json(self):
+        with self.lock:
+            return [{'time': sample.timestamp,
+                     'values': {'%s.%s' % k: v for k, v in sample.items()}}
+                    for sample in self.samples]
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        owner = self.server.owner
+        path = self.path.split('?')[0].rstrip('/')
+        if path in ('', '/snapshot'):
+            nodes, version = owner.snapshot.nodes()
+            self.send_json(str(version), {
+                'version': version,
+                'nodes': {address: {driver: {'value': v, 'updated': t}
+                    for driver, (v, t) in drivers.items()}
+                    for address, drivers in nodes.items()},
+                })
+        elif path == '/history' and owner.history is not None:
+            self.send_json('h%d' % owner.history.count,
+                    owner.history.to_json())
+        elif path == '/metrics':
+            self.send_body(200, 'text/plain; version=0.0.4',
+                    format_metrics(owner.metrics()).encode())
+        else:
+            self.send_body(404, 'text/plain', b'not found\n')
+
+    def send_json(self, tag, data):
+        etag = '"%s-%s"' % (START_ID, tag)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_body(200, 'application/json', json.dumps(data).encode(),
+                etag)
+
+    def send_body(self, code, content_type, body, etag=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.owner.logger.debug('snapserver: ' + format, *args)
+
+
+def format_metrics(metrics):
+    # metrics is a list of (name, labels, value), labels a dict or None.
+    lines = []
+    for name, labels, value in metrics:
+        if labels:
+            name = '%s{%s}' % (name, ','.join(
+                '%s="%s"' % (k, labels[k]) for k in sorted(labels)))
+        lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotServer(object):
+    def __init__(self, snapshot, metrics, logger, history=None):
+        self.snapshot = snapshot
+        self.metrics = metrics
+        self.logger = logger
+        self.history = history
+        self.server = None
+        self.address = None
+
+    def start(self, port, bind='127.0.0.1'):
+        if self.server is not None and self.address == (bind, port):
+            return
+        self.stop()
+        try:
+            self.server = _Server((bind, port), _Handler)
+        except OSError as err:
+            self.logger.error('Unable to start snapshot server on %s:%d: %s',
+                    bind, port, err)
+            return
+        self.server.owner = self
+        self.address = (bind, port)
+        thread = threading.Thread(target=self.server.serve_forever,
+                name='snapserver')
+        thread.daemon = True
+        thread.start()
+        self.logger.info('Snapshot server listening on %s:%d', bind, port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.address = None
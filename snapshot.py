@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+In-memory snapshot of the driver values published by the node server.
+Copyright (c) 2018 Robert Paauwe
+
+Every (node, driver) value is stored with the version number of the
+change that last modified it. Entries are kept in the order they were
+last changed, so finding everything that changed since a given version
+only has to look at the changed entries, not at every driver of every
+node.
+"""
+import collections
+import threading
+import time
+
+
+class DriverSnapshot(object):
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def update(self, address, driver, value):
+        # Returns True if the value changed.
+        key = (address, driver)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == value:
+                return False
+            self.version += 1
+            self.entries[key] = (value, self.version, time.time())
+            self.entries.move_to_end(key)
+            return True
+
+    def get(self, address, driver, default=None):
+        entry = self.entries.get((address, driver))
+        return default if entry is None else entry[0]
+
+    def changed_since(self, version):
+        # Returns the list of ((address, driver), value) that changed
+        # after version, newest first, and the current version. The
+        # caller keeps its own version as a cursor.
+        changes = []
+        with self.lock:
+            for key in reversed(self.entries):
+                value, changed, stamp = self.entries[key]
+                if changed <= version:
+                    break
+                changes.append((key, value))
+            return changes, self.version
+
+    def nodes(self):
+        # The whole snapshot as {address: {driver: (value, timestamp)}}
+        nodes = {}
+        with self.lock:
+            for (address, driver), entry in self.entries.items():
+                nodes.setdefault(address, {})[driver] = (entry[0], entry[2])
+            return nodes, self.version
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Differential test of the MeteoBridge XML parsers.
+Copyright (c) 2018 Robert Paauwe
+
+Every parser in mbparse.PARSERS has to give exactly the same records as
+the ElementTree reference for each recorded document in documents/. To
+cover a new case, drop the raw document in there.
+"""
+import glob
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import mbparse
+
+DOCUMENTS = sorted(glob.glob(os.path.join(HERE, 'documents', '*.xml')))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ParserTest(unittest.TestCase):
+    def test_documents_found(self):
+        self.assertTrue(DOCUMENTS)
+
+    def test_same_as_reference(self):
+        for path in DOCUMENTS:
+            data = load(path)
+            reference = mbparse.parse_etree(data)
+            self.assertTrue(reference, path)
+            for name, parser in mbparse.PARSERS.items():
+                with self.subTest(document=os.path.basename(path),
+                        parser=name):
+                    self.assertEqual(parser(data), reference)
+                    self.assertEqual(parser(data.decode()), reference)
+
+    def test_sample_documents(self):
+        for data in mbparse.SAMPLE_DOCUMENTS:
+            reference = mbparse.parse_etree(data)
+            for name, parser in mbparse.PARSERS.items():
+                with self.subTest(parser=name):
+                    self.assertEqual(parser(data), reference)
+
+    def test_quoting(self):
+        records = mbparse.get_parser(mbparse.DEFAULT_PARSER)(
+                load(os.path.join(HERE, 'documents', 'quoting.xml')))
+        attrs = {(tag, sid): a for tag, sid, a in records}
+        self.assertEqual(attrs[('TH', 'th0')]['temp'], '7.5')
+        self.assertEqual(attrs[('THB', 'thb0')]['seapress'], '1006.1')
+        self.assertEqual(attrs[('SOL', 'sol0')]['name'],
+                'roof & garden <south> "A" °')
+
+    def test_unknown_parser(self):
+        self.assertIs(mbparse.get_parser('scan'),
+                mbparse.PARSERS[mbparse.DEFAULT_PARSER])
+
+
+if __name__ == "__main__":
+    unittest.main()
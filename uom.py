@@ -23,6 +23,7 @@ UOM = {
         'I_KM': 83,
         'I_MILE': 116,
         'I_MPS' : 49,
+        'I_SOLAR_ENERGY' : 33,
         }
 
 
@@ -88,12 +89,20 @@ RAIN_DRVS = {
 LITE_DRVS = {
         'uv' : 'ST',
         'solar_radiation' : 'GV0',
-        'illuminace' : 'GV1'
+        'illuminace' : 'GV1',
+        'solar_energy' : 'GV2',
+        'solar_energy_total' : 'GV3',
+        'evapotranspiration' : 'GV4',
+        'evapotranspiration_total' : 'GV5',
         }
 LITE_EDIT = {
         'uv' : 'I_UV',
         'solar_radiation' : 'I_RADIATION',
-        'illuminace' : 'I_LUX'
+        'illuminace' : 'I_LUX',
+        'solar_energy' : 'I_SOLAR_ENERGY',
+        'solar_energy_total' : 'I_SOLAR_ENERGY',
+        'evapotranspiration' : 'I_MM',
+        'evapotranspiration_total' : 'I_MM',
         }
 
 
@@ -102,3 +111,14 @@ LTNG_DRVS = {
         'distance' : 'GV0'
         }
 
+
+# Driver maps by node address
+NODE_DRVS = {
+        'temperature' : TEMP_DRVS,
+        'humidity' : HUMD_DRVS,
+        'pressure' : PRES_DRVS,
+        'wind' : WIND_DRVS,
+        'rain' : RAIN_DRVS,
+        'light' : LITE_DRVS,
+        'lightning' : LTNG_DRVS,
+        }
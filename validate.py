@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Sanity checks for MeteoBridge samples before they get published.
+Copyright (c) 2018 Robert Paauwe
+
+Two checks are made on each (node, driver key) value, in metric units:
+
+  - the value has to be within physically possible limits, this catches
+    things like 0 hPa pressure or a 0% humidity reading.
+  - for the slowly changing values, it can't be too far from the rolling
+    median of recent values. "Too far" is measured in median absolute
+    deviations (MAD), with a per driver floor so a perfectly steady
+    reading doesn't turn every small change into a spike.
+
+Rejected values are removed from the sample and counted.
+"""
+import bisect
+import collections
+
+# (min, max) allowed for each value.
+LIMITS = {
+        ('temperature', 'main'): (-90.0, 60.0),
+        ('temperature', 'dewpoint'): (-90.0, 60.0),
+        ('temperature', 'windchill'): (-100.0, 60.0),
+        ('humidity', 'main'): (1.0, 100.0),
+        ('pressure', 'station'): (300.0, 1100.0),
+        ('pressure', 'sealevel'): (850.0, 1090.0),
+        ('wind', 'windspeed'): (0.0, 115.0),
+        ('wind', 'gustspeed'): (0.0, 115.0),
+        ('wind', 'winddir'): (0.0, 360.0),
+        ('rain', 'rate'): (0.0, 2000.0),
+        ('rain', 'total'): (0.0, 100000.0),
+        ('light', 'uv'): (0.0, 20.0),
+        ('light', 'solar_radiation'): (0.0, 2000.0),
+        ('light', 'evo'): (0.0, 5.0),
+        }
+
+# Values checked for spikes and the smallest deviation that is ever
+# considered a spike. Wind, rain and light change too quickly to be
+# checked this way.
+SPIKES = {
+        ('temperature', 'main'): 2.0,
+        ('temperature', 'dewpoint'): 2.0,
+        ('humidity', 'main'): 10.0,
+        ('pressure', 'station'): 2.0,
+        ('pressure', 'sealevel'): 2.0,
+        }
+
+
+class RollingMedian(object):
+    # Median of the last size values. The values are kept in a sorted
+    # list as well as in arrival order. bisect finds the positions in
+    # O(log n) but the insert and delete still shift the list, so an
+    # update is O(n). That is nothing for a window of 15 values.
+    def __init__(self, size):
+        self.size = size
+        self.window = collections.deque()
+        self.ordered = []
+
+    def __len__(self):
+        return len(self.window)
+
+    def add(self, value):
+        if len(self.window) == self.size:
+            old = self.window.popleft()
+            del self.ordered[bisect.bisect_left(self.ordered, old)]
+        self.window.append(value)
+        bisect.insort(self.ordered, value)
+
+    def median(self):
+        n = len(self.ordered)
+        m = n // 2
+        if n % 2:
+            return self.ordered[m]
+        return (self.ordered[m - 1] + self.ordered[m]) / 2.0
+
+
+class Validator(object):
+    def __init__(self, logger, limits=LIMITS, spikes=SPIKES, window=15,
+            threshold=5.0, min_samples=5):
+        self.logger = logger
+        self.limits = limits
+        self.spikes = spikes
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.history = {}
+        self.rejected = collections.Counter()
+
+    def check(self, key, value):
+        limit = self.limits.get(key)
+        if limit is not None and not (limit[0] <= value <= limit[1]):
+            return self.reject(key, value, 'out of range')
+
+        floor = self.spikes.get(key)
+        if floor is None:
+            return True
+
+        if key not in self.history:
+            self.history[key] = (RollingMedian(self.window),
+                    RollingMedian(self.window))
+        values, deviations = self.history[key]
+
+        ok = True
+        deviation = 0.0
+        if len(values) > 0:
+            deviation = abs(value - values.median())
+            if len(values) >= self.min_samples:
+                # 1.4826 scales the MAD to a standard deviation.
+                scale = max(1.4826 * deviations.median(), floor)
+                ok = deviation <= self.threshold * scale
+
+        # Rejected values still go into the window so that a real step
+        # change is accepted once it persists.
+        values.add(value)
+        deviations.add(deviation)
+
+        if not ok:
+            return self.reject(key, value, 'spike')
+        return True
+
+    def reject(self, key, value, reason):
+        self.rejected[key] += 1
+        self.logger.info('Rejected %s/%s = %s (%s)', key[0], key[1], value,
+                reason)
+        return False
+
+
+def validate(stream, validator):
+    for sample in stream:
+        for key in [k for k in sample if not validator.check(k, sample[k])]:
+            del sample[key]
+        yield sample
@@ -5,11 +5,21 @@ import re
 import os
 import zipfile
 import json
+import hashlib
 import uom
 
 pfx = "write_profile:"
 
 VERSION_FILE = "profile/version.txt"
+NODEDEF_FILE = "profile/nodedef/nodedefs.xml"
+PROFILE_ZIP = "profile.zip"
+
+# The profile installed last time is identified by a hash of the driver
+# lists and the profile_version from server.json. If nothing changed
+# the existing files are used as is. The hash is only saved once the
+# profile was installed, see installed().
+CACHE_FILE = "profile.cache"
+CACHED = "cached"
 
 # define templates for the various sensor nodes we have available. Each
 # sensor node will have a pre-defined list of drivers. When we build
@@ -32,6 +42,13 @@ def write_profile(logger, temperature_list, humidity_list, pressure_list,
         logger.error("Unable to complete without server data...")
         return False
 
+    key = profile_key(sd, [temperature_list, humidity_list, pressure_list,
+        wind_list, rain_list, light_list, lightning_list])
+    if read_profile_key() == key and os.path.exists(NODEDEF_FILE) and \
+            os.path.exists(PROFILE_ZIP):
+        logger.info("{0} Profile is unchanged, using cached files".format(pfx))
+        return CACHED
+
     logger.info("{0} Writing profile/nodedef/nodedefs.xml".format(pfx))
     if not os.path.exists("profile/nodedef"):
         try:
@@ -39,7 +56,7 @@ def write_profile(logger, temperature_list, humidity_list, pressure_list,
         except:
             LOGGER.error('unable to create node definition directory.')
 
-    nodedef = open("profile/nodedef/nodedefs.xml", "w")
+    nodedef = open(NODEDEF_FILE, "w")
     nodedef.write("<nodeDefs>\n")
 
     # First, write the controller node definition
@@ -47,6 +64,8 @@ def write_profile(logger, temperature_list, humidity_list, pressure_list,
     nodedef.write("    <sts>\n")
     nodedef.write("      <st id=\"ST\" editor=\"bool\" />\n")
     nodedef.write("      <st id=\"GV0\" editor=\"I_VOLTS\" />\n")
+    nodedef.write("      <st id=\"GV1\" editor=\"I_CONNECTION\" />\n")
+    nodedef.write("      <st id=\"GV2\" editor=\"I_COUNT\" />\n")
     nodedef.write("    </sts>\n")
     nodedef.write("    <cmds>\n")
     nodedef.write("      <sends />\n")
@@ -54,6 +73,8 @@ def write_profile(logger, temperature_list, humidity_list, pressure_list,
     nodedef.write("        <cmd id=\"DISCOVER\" />\n")
     nodedef.write("        <cmd id=\"REMOVE_NOTICES_ALL\" />\n")
     nodedef.write("        <cmd id=\"UPDATE_PROFILE\" />\n")
+    nodedef.write("        <cmd id=\"REPLAY\" />\n")
+    nodedef.write("        <cmd id=\"REPLAY_STOP\" />\n")
     nodedef.write("      </accepts>\n")
     nodedef.write("    </cmds>\n")
     nodedef.write("  </nodeDef>\n\n")
@@ -130,12 +151,46 @@ def write_profile(logger, temperature_list, humidity_list, pressure_list,
     write_profile_zip(logger)
 
     logger.info(pfx + " done.")
+    return True
+
+
+def installed(logger, temperature_list, humidity_list, pressure_list,
+        wind_list, rain_list, light_list, lightning_list):
+    # Called after the profile was pushed to the ISY, the next start with
+    # the same lists can skip writing and installing it.
+    sd = get_server_data(logger)
+    if sd is False:
+        return
+    write_profile_key(logger, profile_key(sd, [temperature_list,
+        humidity_list, pressure_list, wind_list, rain_list, light_list,
+        lightning_list]))
+
+
+def profile_key(sd, lists):
+    data = json.dumps([sd['profile_version'], lists], sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def read_profile_key():
+    try:
+        with open(CACHE_FILE) as f:
+            return f.read().strip()
+    except (OSError, IOError):
+        return None
+
+
+def write_profile_key(logger, key):
+    try:
+        with open(CACHE_FILE, 'w') as f:
+            f.write(key)
+    except (OSError, IOError) as err:
+        logger.error('{0} failed to write {1}: {2}'.format(pfx, CACHE_FILE, err))
 
 
 def write_profile_zip(logger):
     src = 'profile'
     abs_src = os.path.abspath(src)
-    with zipfile.ZipFile('profile.zip', 'w') as zf:
+    with zipfile.ZipFile(PROFILE_ZIP, 'w') as zf:
         for dirname, subdirs, files in os.walk(src):
             # Ignore dirs starint with a dot, stupid .AppleDouble...
             if not "/." in dirname:
@@ -143,8 +198,8 @@ def write_profile_zip(logger):
                     if filename.endswith('.xml') or filename.endswith('txt'):
                         absname = os.path.abspath(os.path.join(dirname, filename))
                         arcname = absname[len(abs_src) + 1:]
-                        logger.info('write_profile_zip: %s as %s' %
-                                (os.path.join(dirname, filename), arcname))
+                        logger.info('write_profile_zip: %s as %s',
+                                os.path.join(dirname, filename), arcname)
                         zf.write(absname, arcname)
     zf.close()
 